@@ -2,10 +2,21 @@ import os
 import re
 import time
 import json
+import shutil
+import threading
+import http.client
+import http.cookiejar
+import urllib.error
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from functools import lru_cache, partial
 from pathlib import Path
-from urllib.parse import urljoin, urlparse
+from queue import Empty, Queue
+from urllib.parse import unquote, urljoin, urlparse
 
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+from playwright.sync_api import sync_playwright, Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
 from dotenv import load_dotenv
 import os
 
@@ -18,6 +29,7 @@ load_dotenv()
 # Env / Config
 # ---------------------------
 BASE_URL                 = os.getenv("BASE_URL", "").rstrip("/")
+BASE_NETLOC              = urlparse(BASE_URL).netloc
 LOGIN_URL                = os.getenv("LOGIN_URL", "").strip()
 DOCS_URL                 = os.getenv("DOCS_URL", "").strip()
 
@@ -33,6 +45,9 @@ SUBMIT_SELECTOR          = os.getenv("SUBMIT_SELECTOR", "button[type='submit'],i
 FOLDER_LINK_SELECTOR     = os.getenv("FOLDER_LINK_SELECTOR", "a.folder, a[role='treeitem'][data-type='folder']")
 FILE_LINK_SELECTOR       = os.getenv("FILE_LINK_SELECTOR", "a.file, a[download], a[data-type='file']")
 
+# Either kind of link; used to tell when an in-app (SPA) navigation has rendered
+LINK_SELECTOR            = ", ".join(s for s in (FOLDER_LINK_SELECTOR, FILE_LINK_SELECTOR) if s)
+
 # Optional: a selector for the "current folder" name, useful for naming
 CURRENT_FOLDER_SELECTOR  = os.getenv("CURRENT_FOLDER_SELECTOR", "")
 
@@ -42,47 +57,258 @@ RESTRICT_TO_DOMAIN       = os.getenv("RESTRICT_TO_DOMAIN", "true").lower() == "t
 # Rate limits / timing
 NAV_TIMEOUT_MS           = int(os.getenv("NAV_TIMEOUT_MS", "30000"))
 POST_LOGIN_WAIT_MS       = int(os.getenv("POST_LOGIN_WAIT_MS", "1500"))
-CRAWL_DELAY_MS           = int(os.getenv("CRAWL_DELAY_MS", "300"))
+# Per-host spacing between requests; widened on 429/503 and eased back on success
+# (CRAWL_DELAY_MS is still honoured as the old name for MIN_INTERVAL_MS)
+MIN_INTERVAL_MS          = int(os.getenv("MIN_INTERVAL_MS", os.getenv("CRAWL_DELAY_MS", "300")))
+DOWNLOAD_MIN_INTERVAL_MS = int(os.getenv("DOWNLOAD_MIN_INTERVAL_MS", "0"))
+# How many times a download answered with 429/503 is retried after backing off
+DOWNLOAD_RETRIES         = int(os.getenv("DOWNLOAD_RETRIES", "5"))
+# Dropped connections / timeouts retried over a fresh connection before the browser takes over
+TRANSPORT_RETRIES        = int(os.getenv("TRANSPORT_RETRIES", "3"))
+
+# Optional: route between folders in-page (history.pushState) instead of reloading the app
+SPA_MODE                 = os.getenv("SPA_MODE", "false").lower() == "true"
+SPA_SETTLE_MS            = int(os.getenv("SPA_SETTLE_MS", "5000"))
+# The listing counts as rendered once its link count has held still this long
+SPA_QUIET_MS             = int(os.getenv("SPA_QUIET_MS", "500"))
 
 # Download & state
 DOWNLOAD_ROOT            = Path(os.getenv("DOWNLOAD_ROOT", "/downloads"))
 STATE_FILE               = Path(os.getenv("STATE_FILE", "/state/downloaded.json"))
+# Downloads are journaled next to STATE_FILE and folded into it every N entries (0: only on exit)
+STATE_LOG_FILE           = STATE_FILE.with_suffix(".log")
+STATE_COMPACT_EVERY      = int(os.getenv("STATE_COMPACT_EVERY", "500"))
+
+# Resumable crawls: BFS frontier snapshot, written every N dequeues (0 disables) and trusted for TTL hours
+CHECKPOINT_FILE          = Path(os.getenv("CHECKPOINT_FILE", "/state/frontier.json"))
+CHECKPOINT_EVERY         = int(os.getenv("CHECKPOINT_EVERY", "50"))
+CHECKPOINT_TTL_H         = float(os.getenv("CHECKPOINT_TTL_H", "24"))
+# Finished downloads are dropped from the in-memory queued-file map every N dequeues
+QUEUED_PRUNE_EVERY       = max(1, int(os.getenv("QUEUED_PRUNE_EVERY", "50")))
+
+# Parallel downloads: max in-flight HTTP fetches on the logged-in session's cookies
+DOWNLOAD_CONCURRENCY     = int(os.getenv("DOWNLOAD_CONCURRENCY", "8"))
+
+# Skip assets the crawler never reads: Playwright resource types + analytics hosts
+BLOCK_RESOURCE_TYPES     = {t.strip() for t in os.getenv("BLOCK_RESOURCE_TYPES", "image,font,media").split(",") if t.strip()}
+BLOCK_URL_PATTERN        = os.getenv("BLOCK_URL_PATTERN", r"google-analytics\.com|googletagmanager\.com|doubleclick\.net|connect\.facebook\.net|hotjar\.com|segment\.(io|com)").strip()
+BLOCK_URL_RE             = re.compile(BLOCK_URL_PATTERN) if BLOCK_URL_PATTERN else None
+
+# filename="x.pdf" / filename*=UTF-8''x.pdf
+CONTENT_DISPOSITION_RE   = re.compile(r"filename\*?=(?:[\w-]+'[^']*')?\"?([^\";]+)\"?", re.I)
 
 # --------------------------------
 # Helpers
 # --------------------------------
+_BAD_CHARS = str.maketrans(dict.fromkeys('\\/:*?"<>|', "_"))  # Windows-invalid chars + common bad ones
+_WS        = re.compile(r"\s+")
+
 def sanitize_filename(name: str) -> str:
-    name = name.strip()
-    name = re.sub(r"[\\/:*?\"<>|]+", "_", name)  # Windows-invalid chars + common bad ones
-    name = re.sub(r"\s+", " ", name)
-    return name[:200] if len(name) > 200 else name
+    name = _WS.sub(" ", name.strip().translate(_BAD_CHARS))
+    return name[:200]
 
 def ensure_dir(p: Path) -> None:
     p.mkdir(parents=True, exist_ok=True)
 
+# Recently saved downloads, oldest first, whose page cache gets a second DONTNEED
+_RECENT_WRITES      = deque()
+_RECENT_WRITES_LOCK = threading.Lock()
+PAGE_CACHE_LAG      = 16
+
+def _fadvise_dontneed(path: Path) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+def drop_page_cache(path: Path) -> None:
+    # Downloads are never read back; let the kernel evict them instead of the
+    # browser's hot pages. DONTNEED skips dirty pages but starts writing them
+    # back, so a second pass a few files later drops them without any fsync.
+    if not hasattr(os, "posix_fadvise"):
+        return
+    _fadvise_dontneed(path)
+    with _RECENT_WRITES_LOCK:
+        _RECENT_WRITES.append(path)
+        stale = _RECENT_WRITES.popleft() if len(_RECENT_WRITES) > PAGE_CACHE_LAG else None
+    if stale is not None:
+        _fadvise_dontneed(stale)
+
+def save_stream(out_path: Path, src) -> None:
+    ensure_dir(out_path.parent)
+    with open(out_path, "wb") as f:
+        shutil.copyfileobj(src, f, 1 << 20)
+    drop_page_cache(out_path)
+
+# The same URL is parsed by same_origin() and canon() on every enqueue
+parse_url = lru_cache(maxsize=8192)(urlparse)
+
 def same_origin(url: str, base: str) -> bool:
+    """Same host as BASE_URL, or as `base` when BASE_URL is unset."""
     if not RESTRICT_TO_DOMAIN:
         return True
     try:
-        return urlparse(url).netloc == urlparse(base).netloc
+        return parse_url(url).netloc == (BASE_NETLOC or parse_url(base).netloc)
     except Exception:
         return True
 
+def canon(url: str, keep_route: bool = False) -> str:
+    """Dedup key for a URL: lower-cased scheme/host, no trailing slash or fragment.
+
+    keep_route keeps hash-router fragments (#/..., #!...), which name distinct
+    folders in an SPA; file keys leave it off.
+    """
+    p = parse_url(url)
+    key = f"{p.scheme.lower()}://{p.netloc.lower()}{p.path.rstrip('/') or '/'}"
+    if p.query:
+        key = f"{key}?{p.query}"
+    if keep_route and p.fragment.startswith(("/", "!")):
+        key = f"{key}#{p.fragment}"
+    return key
+
 def load_state() -> set:
+    done = set()
     if STATE_FILE.exists():
         try:
-            return set(json.loads(STATE_FILE.read_text()))
+            done.update(json.loads(STATE_FILE.read_text()))
         except Exception:
-            return set()
-    return set()
+            pass
+    # Entries journaled since the last compaction
+    if STATE_LOG_FILE.exists():
+        done.update(line for line in STATE_LOG_FILE.read_text().splitlines() if line)
+    return done
 
 def save_state(done: set) -> None:
     ensure_dir(STATE_FILE.parent)
-    STATE_FILE.write_text(json.dumps(sorted(done), indent=2))
+    tmp = STATE_FILE.with_suffix(".tmp")
+    tmp.write_text(json.dumps(sorted(done), indent=2))
+    os.replace(tmp, STATE_FILE)
+
+def load_checkpoint():
+    """Return (queue, visited, files) from a fresh CHECKPOINT_FILE, or None."""
+    if not CHECKPOINT_FILE.exists():
+        return None
+    if time.time() - CHECKPOINT_FILE.stat().st_mtime > CHECKPOINT_TTL_H * 3600:
+        return None
+    try:
+        data = json.loads(CHECKPOINT_FILE.read_text())
+        queue = deque((u, Path(p)) for u, p in data["queue"])
+        files = [(u, Path(p), t) for u, p, t in data["files"]]
+        return queue, set(data["visited"]), files
+    except Exception:
+        return None
+
+def save_checkpoint(queue, visited, files) -> None:
+    ensure_dir(CHECKPOINT_FILE.parent)
+    tmp = CHECKPOINT_FILE.with_suffix(".tmp")
+    tmp.write_text(json.dumps({
+        "queue": [[u, str(p)] for u, p in queue],
+        "visited": sorted(visited),
+        "files": [[u, str(p), t] for u, p, t in files],
+    }))
+    os.replace(tmp, CHECKPOINT_FILE)
+
+class DoneState:
+    """Thread-safe set of downloaded URLs (canon() keys), journaled to STATE_LOG_FILE as they land."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.urls = {canon(u) for u in load_state()}
+        ensure_dir(STATE_LOG_FILE.parent)
+        self.log = open(STATE_LOG_FILE, "a", encoding="utf-8")
+        self.pending = 0
+
+    def __contains__(self, url: str) -> bool:
+        with self.lock:
+            return url in self.urls
+
+    def add(self, url: str) -> None:
+        with self.lock:
+            self.urls.add(url)
+            self.log.write(url + "\n")
+            self.log.flush()
+            self.pending += 1
+            if STATE_COMPACT_EVERY > 0 and self.pending >= STATE_COMPACT_EVERY:
+                self._compact()
+
+    def close(self) -> None:
+        with self.lock:
+            self._compact()
+            self.log.close()
+
+    def _compact(self) -> None:
+        # STATE_FILE is replaced atomically before the journal is cleared, so a
+        # crash in between only leaves duplicates that load_state() merges
+        save_state(self.urls)
+        self.log.seek(0)
+        self.log.truncate()
+        self.pending = 0
 
 # --------------------------------
 # Core
 # --------------------------------
+class DomainLimiter:
+    """Minimum spacing between requests to the same host, shared across threads."""
+
+    BACKOFF_STATUSES = {429, 503}
+    MAX_INTERVAL     = 60.0
+
+    def __init__(self, min_interval_ms: int):
+        self.base  = min_interval_ms / 1000.0
+        self.lock  = threading.Lock()
+        self.hosts = {}  # netloc -> [next_allowed, interval]
+
+    def _slot(self, netloc: str) -> list:
+        return self.hosts.setdefault(netloc, [time.monotonic(), self.base])
+
+    def reserve(self, netloc: str) -> float:
+        """Claim the next request slot for netloc; returns the seconds to wait for it."""
+        with self.lock:
+            now = time.monotonic()
+            slot = self._slot(netloc)
+            start = max(now, slot[0])
+            slot[0] = start + slot[1]
+            return start - now
+
+    def wait(self, netloc: str) -> None:
+        time.sleep(self.reserve(netloc))
+
+    def update(self, netloc: str, status: int, retry_after: float = 0.0) -> None:
+        with self.lock:
+            slot = self._slot(netloc)
+            if status in self.BACKOFF_STATUSES:
+                slot[1] = min(max(slot[1] * 2, 1.0), self.MAX_INTERVAL)
+                # Slots already handed out were spaced for the old interval; hold the next one back too
+                slot[0] = max(slot[0], time.monotonic() + min(max(slot[1], retry_after), self.MAX_INTERVAL))
+                print(f"[BACKOFF] HTTP {status} from {netloc}; spacing requests {slot[1]:.1f}s apart")
+            else:
+                slot[1] = max(self.base, slot[1] * 0.9)
+
+def retry_after_seconds(value) -> float:
+    """Retry-After header (delta-seconds or HTTP-date) as seconds from now; 0 if absent/garbled."""
+    if not value:
+        return 0.0
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0.0
+
+nav_limiter      = DomainLimiter(MIN_INTERVAL_MS)
+download_limiter = DomainLimiter(DOWNLOAD_MIN_INTERVAL_MS)
+
+def block_resources(route):
+    req = route.request
+    if req.resource_type in BLOCK_RESOURCE_TYPES or (BLOCK_URL_RE and BLOCK_URL_RE.search(req.url)):
+        route.abort()
+    else:
+        route.continue_()
+
 def login(page):
     if not LOGIN_URL:
         return
@@ -97,38 +323,247 @@ def login(page):
     # small wait for redirects/messages
     page.wait_for_timeout(POST_LOGIN_WAIT_MS)
 
-def collect_links(page, folder_selector, file_selector):
-    folders = []
-    files   = []
-    # folders
-    if folder_selector:
-        for el in page.query_selector_all(folder_selector):
-            href = el.get_attribute("href") or ""
-            text = (el.inner_text() or "").strip()
-            if href:
-                folders.append((href, text))
-    # files
-    if file_selector:
-        for el in page.query_selector_all(file_selector):
-            href = el.get_attribute("href") or ""
-            text = (el.inner_text() or "").strip()
-            # some file links have explicit download attr; use text or download filename
-            dl_name = el.get_attribute("download") or text
-            if href:
-                files.append((href, dl_name))
-    return folders, files
-
-def get_current_folder_name(page):
-    if not CURRENT_FOLDER_SELECTOR:
-        return ""
-    el = page.query_selector(CURRENT_FOLDER_SELECTOR)
-    if not el:
-        return ""
-    return (el.inner_text() or "").strip()
+def navigate(page, url):
+    if SPA_MODE and LINK_SELECTOR and page.url.startswith("http"):
+        # Tag the links on screen, push the route, wait for the app to render new
+        # ones, then for the listing to stop growing before it gets read
+        try:
+            page.evaluate("""([u, sel]) => {
+                const links = Array.from(document.querySelectorAll(sel));
+                links.forEach((e) => e.setAttribute('data-crawler-seen', ''));
+                window.__crawlerSettle = {n: -1, t: 0, prev: links.map((e) => e.getAttribute('href')).join('\n')};
+                history.pushState({}, '', u);
+                window.dispatchEvent(new PopStateEvent('popstate', {state: {}}));
+            }""", [url, LINK_SELECTOR])
+            page.wait_for_selector(f":is({LINK_SELECTOR}):not([data-crawler-seen])", timeout=SPA_SETTLE_MS)
+            page.wait_for_function("""([sel, quietMs]) => {
+                const links = document.querySelectorAll(sel), w = window.__crawlerSettle, now = performance.now();
+                if (links.length !== w.n) { w.n = links.length; w.t = now; return false; }
+                // A re-render of the previous folder's listing doesn't count
+                return now - w.t >= quietMs && Array.from(links, (e) => e.getAttribute('href')).join('\n') !== w.prev;
+            }""", arg=[LINK_SELECTOR, SPA_QUIET_MS], polling=100, timeout=SPA_SETTLE_MS)
+            return None
+        except PlaywrightError:
+            pass  # cross-origin, or the router rendered nothing new: load the page for real
+    return page.goto(url, timeout=NAV_TIMEOUT_MS, wait_until="domcontentloaded")
+
+def collect_links(page, folder_selector, file_selector, current_selector=""):
+    # One evaluate round-trip instead of query_selector_all + per-element
+    # get_attribute/inner_text calls (each of those is a Playwright IPC);
+    # the optional "current folder" name rides along in the same call
+    links = page.evaluate("""([fs, fl, cs]) => {
+        // innerText forces layout, so file links named by their download attr skip it
+        const grab = (s, preferDl) => s ? Array.from(document.querySelectorAll(s), (e) => {
+            const dl = preferDl ? (e.getAttribute('download') || '') : '';
+            return {href: e.getAttribute('href') || '', text: dl ? '' : (e.innerText || '').trim(), dl};
+        }) : [];
+        const cur = cs ? document.querySelector(cs) : null;
+        return {folders: grab(fs, false), files: grab(fl, true), current: cur ? (cur.innerText || '').trim() : ''};
+    }""", [folder_selector, file_selector, current_selector])
+    folders = [(l["href"], l["text"]) for l in links["folders"] if l["href"]]
+    # some file links have explicit download attr; use text or download filename
+    files   = [(l["href"], l["dl"] or l["text"]) for l in links["files"] if l["href"]]
+    return folders, files, links["current"]
+
+def browser_download(page, user_agent, file_url, effective_rel, text) -> bool:
+    """Fetch one file into DOWNLOAD_ROOT / effective_rel via the page; returns True once saved."""
+    print(f"[BROWSER] {file_url}")
+    netloc = parse_url(file_url).netloc
+    nav_limiter.wait(netloc)
+    # Use Playwright's download handling when clicking is required
+    try:
+        with page.expect_download(timeout=NAV_TIMEOUT_MS) as dl_info:
+            # Create a temporary clickable link in DOM (works even if original link is off-screen)
+            page.evaluate("""(u)=>{ const a=document.createElement('a'); a.href=u; a.target='_self'; document.body.appendChild(a); a.click(); a.remove(); }""", file_url)
+        download = dl_info.value
+    except PlaywrightTimeoutError:
+        # No download event; fetch the URL directly with the page's cookies. The
+        # jar only sends them where they are scoped, even across redirects.
+        opener = session_opener({"storage_state": {"cookies": page.context.cookies()}, "user_agent": user_agent})
+        try:
+            return fetch_file(opener, file_url, effective_rel, text)
+        except NeedsBrowser:
+            print(f"[ERROR] Direct fetch failed: redirected to login for {file_url}")
+        except RateLimited:
+            print(f"[ERROR] Direct fetch failed: rate-limited on {file_url}")
+        except Exception as e:
+            print(f"[ERROR] Direct fetch failed: {e}")
+        return False
+    else:
+        # Save with site-suggested filename
+        suggested = sanitize_filename(download.suggested_filename or (text or "file"))
+        out_path = (DOWNLOAD_ROOT / effective_rel / suggested)
+        ensure_dir(out_path.parent)
+        download.save_as(str(out_path))
+        drop_page_cache(out_path)
+        print(f"[SAVED] {out_path}")
+        return True
+
+class NeedsBrowser(Exception):
+    """The HTTP session was bounced to the login page; retry the file through the browser."""
+
+class RateLimited(Exception):
+    """The host answered 429/503; retry the file once the limiter allows."""
+
+def is_login_url(url: str) -> bool:
+    return bool(LOGIN_URL) and urlparse(url).path == urlparse(LOGIN_URL).path
+
+def response_filename(headers: dict, file_url: str, text: str) -> str:
+    # Prefer the server's Content-Disposition name, like a browser download would
+    m = CONTENT_DISPOSITION_RE.search(headers.get("content-disposition", ""))
+    name = unquote(m.group(1)) if m else ""
+    return sanitize_filename(name or os.path.basename(urlparse(file_url).path) or (text or "file"))
+
+def cookie_jar(storage_state: dict) -> http.cookiejar.CookieJar:
+    """Load the browser context's cookies into a jar urllib can send them from."""
+    jar = http.cookiejar.CookieJar()
+    for c in storage_state.get("cookies", []):
+        domain = c["domain"]
+        session_only = c.get("expires", -1) <= 0
+        jar.set_cookie(http.cookiejar.Cookie(
+            version=0, name=c["name"], value=c["value"], port=None, port_specified=False,
+            domain=domain, domain_specified=domain.startswith("."), domain_initial_dot=domain.startswith("."),
+            path=c.get("path", "/"), path_specified=True, secure=c.get("secure", False),
+            expires=None if session_only else int(c["expires"]), discard=session_only,
+            comment=None, comment_url=None, rest={"HttpOnly": None} if c.get("httpOnly") else {},
+        ))
+    return jar
+
+class TrackedResponse(http.client.HTTPResponse):
+    """Remembers whether it was closed before its body was read to the end."""
+    cut_short = False
+
+    def close(self):
+        # fp is dropped once the body is exhausted; still set means bytes are left on the socket
+        self.cut_short = self.fp is not None
+        super().close()
+
+class KeepAliveHandler(urllib.request.HTTPHandler, urllib.request.HTTPSHandler):
+    """urllib handler that keeps one open connection per host and thread.
+
+    Stock urllib sends Connection: close and reconnects (TCP + TLS) for every
+    request; download workers are long-lived threads, so their sockets are too.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.local = threading.local()
+
+    def http_open(self, req):
+        return self._open(http.client.HTTPConnection, req)
+
+    def https_open(self, req):
+        return self._open(http.client.HTTPSConnection, req)
+
+    def _open(self, conn_class, req):
+        conns = self.local.__dict__.setdefault("conns", {})  # (class, host) -> (conn, last response)
+        key = (conn_class, req.host)
+        # Same header merge as AbstractHTTPHandler.do_open, minus Connection: close
+        headers = dict(req.unredirected_hdrs)
+        headers.update({k: v for k, v in req.headers.items() if k not in headers})
+        headers = {k.title(): v for k, v in headers.items()}
+        conn, last = conns.pop(key, (None, None))
+        if conn is not None and (not last.isclosed() or last.cut_short):
+            conn.close()  # unread body still on the wire; the socket can't be reused
+            conn = None
+        while True:
+            fresh = conn is None
+            if fresh:
+                conn = conn_class(req.host, timeout=req.timeout)
+                conn.response_class = TrackedResponse
+            try:
+                conn.request(req.get_method(), req.selector, req.data, headers)
+                resp = conn.getresponse()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if fresh:
+                    raise
+                conn = None  # the server dropped an idle keep-alive connection; reconnect once
+                continue
+            conns[key] = (conn, resp)
+            resp.url = req.get_full_url()
+            resp.msg = resp.reason
+            return resp
+
+def session_opener(session: dict) -> urllib.request.OpenerDirector:
+    opener = urllib.request.build_opener(KeepAliveHandler(), urllib.request.HTTPCookieProcessor(cookie_jar(session["storage_state"])))
+    opener.addheaders = [("User-Agent", session["user_agent"])]
+    return opener
+
+def fetch_file(opener, file_url, effective_rel, text) -> bool:
+    """Stream one file to disk over the session's cookies, without a page."""
+    print(f"[DOWNLOAD] {file_url}")
+    netloc = parse_url(file_url).netloc
+    for attempt in range(TRANSPORT_RETRIES + 1):
+        try:
+            # The timeout applies per socket operation, not to the whole transfer
+            with opener.open(file_url, timeout=NAV_TIMEOUT_MS / 1000.0) as resp:
+                download_limiter.update(netloc, resp.status)
+                if is_login_url(resp.geturl()):
+                    raise NeedsBrowser(file_url)
+                out_path = (DOWNLOAD_ROOT / effective_rel / response_filename(resp.headers, file_url, text))
+                save_stream(out_path, resp)
+        except urllib.error.HTTPError as e:
+            e.close()
+            download_limiter.update(netloc, e.code, retry_after_seconds(e.headers.get("Retry-After")))
+            if e.code == 401:
+                raise NeedsBrowser(file_url)
+            if e.code in DomainLimiter.BACKOFF_STATUSES:
+                raise RateLimited(file_url)
+            print(f"[WARN] HTTP {e.code} for {file_url}")
+            return False
+        except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+            if attempt == TRANSPORT_RETRIES:
+                raise
+            print(f"[RETRY] {file_url}: {e}")
+            time.sleep(2 ** attempt)
+            continue
+        print(f"[SAVED] {out_path}")
+        return True
+
+def download_one(opener, fallbacks, done, job):
+    """Download-pool task for one file; whatever the HTTP session can't fetch goes to fallbacks."""
+    netloc = parse_url(job[0]).netloc
+    try:
+        for _ in range(DOWNLOAD_RETRIES + 1):
+            # After a 429/503 the limiter has already pushed this host's next slot out
+            time.sleep(download_limiter.reserve(netloc))
+            try:
+                saved = fetch_file(opener, *job)
+            except RateLimited:
+                continue
+            if saved:
+                done.add(canon(job[0]))
+            break
+        else:
+            print(f"[WARN] Still rate-limited after {DOWNLOAD_RETRIES} retries: {job[0]}")
+    except NeedsBrowser:
+        fallbacks.put(job)
+    except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+        # Transport errors that outlived fetch_file's retries: give the browser a shot at it
+        print(f"[WARN] {job[0]}: {e}; retrying through the browser")
+        fallbacks.put(job)
+    except Exception as e:
+        print(f"[ERROR] Download failed for {job[0]}: {e}")
+
+def drain_fallbacks(page, fallbacks, done, user_agent):
+    """Run downloads the HTTP session could not fetch through the crawler's page."""
+    while True:
+        try:
+            job = fallbacks.get_nowait()
+        except Empty:
+            return
+        try:
+            saved = browser_download(page, user_agent, *job)
+        except PlaywrightError as e:
+            print(f"[ERROR] Browser download failed for {job[0]}: {e}")
+            continue
+        if saved:
+            done.add(canon(job[0]))
 
 def crawl_documents(context):
     page = context.new_page()
-    done = load_state()
+    done = DoneState()
     ensure_dir(DOWNLOAD_ROOT)
 
     # 1) Login
@@ -139,94 +574,118 @@ def crawl_documents(context):
     if not start:
         raise SystemExit("Please set BASE_URL and DOCS_URL/LOGIN_URL env vars")
 
-    # BFS style queue: list of (url, relative_path)
-    queue = [(start, Path("."))]
-    visited = set()
-
-    while queue:
-        url, rel_path = queue.pop(0)
-        abs_url = url if url.startswith("http") else urljoin(BASE_URL + "/", url)
+    # 3) The download pool shares the login session and the done-state; its
+    # threads transfer files alongside the sync Playwright BFS on this one
+    fallbacks = Queue()
+    session = {
+        "storage_state": context.storage_state(),
+        "user_agent": page.evaluate("() => navigator.userAgent"),
+    }
+    pool = ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY)
+    submit = partial(pool.submit, download_one, session_opener(session), fallbacks, done)
+    queued = {}
+
+    # BFS style queue: deque of (url, relative_path), picked up from a fresh checkpoint if any
+    resumed = load_checkpoint()
+    if resumed:
+        queue, visited, pending = resumed
+        # Files that finished after the snapshot are already in the journal
+        pending = [job for job in pending if canon(job[0]) not in done]
+        print(f"[RESUME] {len(queue)} folders queued, {len(visited)} visited, {len(pending)} files pending")
+        for job in pending:
+            queued[canon(job[0])] = job
+            submit(job)
+    else:
+        queue = deque([(start, Path("."))])
+        visited = set()
+    steps = 0
+
+    # Locals for the per-link loops below: LOAD_FAST instead of global/attribute lookups
+    _urljoin, _same_origin, _sanitize, _canon = urljoin, same_origin, sanitize_filename, canon
+    enqueue = queue.append
 
-        if abs_url in visited:
-            continue
-        if RESTRICT_TO_DOMAIN and not same_origin(abs_url, BASE_URL or abs_url):
-            continue
-
-        print(f"[NAV] {abs_url}")
-        try:
-            page.goto(abs_url, timeout=NAV_TIMEOUT_MS, wait_until="domcontentloaded")
-        except PlaywrightTimeoutError:
-            print(f"[WARN] Timeout navigating to {abs_url}")
-            continue
-
-        visited.add(abs_url)
-        time.sleep(CRAWL_DELAY_MS / 1000.0)
-
-        # Determine current folder (optional)
-        current_folder = get_current_folder_name(page)
-        effective_rel = rel_path / sanitize_filename(current_folder) if current_folder else rel_path
-        ensure_dir(DOWNLOAD_ROOT / effective_rel)
-
-        # Collect subfolders & files
-        folders, files = collect_links(page, FOLDER_LINK_SELECTOR, FILE_LINK_SELECTOR)
-
-        # Enqueue subfolders
-        for href, text in folders:
-            next_url = href if href.startswith("http") else urljoin(abs_url, href)
-            if RESTRICT_TO_DOMAIN and not same_origin(next_url, BASE_URL or abs_url):
+    try:
+        while queue:
+            # Snapshot before popping so the next folder is never lost; files whose
+            # folder is already visited are carried along until they are done
+            steps += 1
+            if steps % QUEUED_PRUNE_EVERY == 0:
+                # Finished jobs are answered by `done` from here on; only the
+                # pending ones need to stay in memory
+                queued = {k: job for k, job in queued.items() if k not in done}
+            if CHECKPOINT_EVERY > 0 and steps % CHECKPOINT_EVERY == 0:
+                save_checkpoint(queue, visited, [job for k, job in queued.items() if k not in done])
+
+            url, rel_path = queue.popleft()
+            abs_url = url if url.startswith("http") else urljoin(BASE_URL + "/", url)
+
+            key = canon(abs_url, keep_route=True)
+            if key in visited:
                 continue
-            next_rel = effective_rel / sanitize_filename(text or "folder")
-            queue.append((next_url, next_rel))
-
-        # Download files
-        for href, text in files:
-            file_url = href if href.startswith("http") else urljoin(abs_url, href)
-            if file_url in done:
-                print(f"[SKIP] Already downloaded: {file_url}")
+            if not same_origin(abs_url, abs_url):
                 continue
 
-            print(f"[DOWNLOAD] {file_url}")
-            # Use Playwright's download handling when clicking is required
+            print(f"[NAV] {abs_url}")
+            netloc = parse_url(abs_url).netloc
+            nav_limiter.wait(netloc)
             try:
-                with page.expect_download(timeout=NAV_TIMEOUT_MS):
-                    # Create a temporary clickable link in DOM (works even if original link is off-screen)
-                    page.evaluate("""(u)=>{ const a=document.createElement('a'); a.href=u; a.target='_self'; document.body.appendChild(a); a.click(); a.remove(); }""", file_url)
-                download = page.wait_for_event("download", timeout=NAV_TIMEOUT_MS)
+                resp = navigate(page, abs_url)
             except PlaywrightTimeoutError:
-                # Some sites start download via navigation; try navigating directly
-                try:
-                    resp = page.goto(file_url, timeout=NAV_TIMEOUT_MS)
-                    # If navigation returns a document instead of a download, try saving its content
-                    if resp and resp.ok:
-                        suggested = sanitize_filename(os.path.basename(urlparse(file_url).path) or (text or "file"))
-                        out_path = (DOWNLOAD_ROOT / effective_rel / suggested)
-                        ensure_dir(out_path.parent)
-                        content = resp.body()
-                        out_path.write_bytes(content)
-                        print(f"[SAVED] {out_path}")
-                        done.add(file_url)
-                        save_state(done)
+                print(f"[WARN] Timeout navigating to {abs_url}")
+                continue
+            if resp:
+                nav_limiter.update(netloc, resp.status, retry_after_seconds(resp.headers.get("retry-after")))
+
+            visited.add(key)
+
+            # Collect subfolders & files, plus the current folder name (optional)
+            folders, files, current_folder = collect_links(page, FOLDER_LINK_SELECTOR, FILE_LINK_SELECTOR, CURRENT_FOLDER_SELECTOR)
+            effective_rel = rel_path / sanitize_filename(current_folder) if current_folder else rel_path
+            ensure_dir(DOWNLOAD_ROOT / effective_rel)
+
+            # Enqueue subfolders
+            for href, text in folders:
+                next_url = href if href.startswith("http") else _urljoin(abs_url, href)
+                if not _same_origin(next_url, abs_url):
                     continue
-                except Exception as e:
-                    print(f"[ERROR] Direct fetch failed: {e}")
+                next_rel = effective_rel / _sanitize(text or "folder")
+                enqueue((next_url, next_rel))
+
+            # Hand files to the downloader
+            for href, text in files:
+                file_url = href if href.startswith("http") else _urljoin(abs_url, href)
+                file_key = _canon(file_url)
+                if file_key in done:
+                    print(f"[SKIP] Already downloaded: {file_url}")
                     continue
-            else:
-                # Save with site-suggested filename
-                suggested = sanitize_filename(download.suggested_filename or (text or "file"))
-                out_path = (DOWNLOAD_ROOT / effective_rel / suggested)
-                ensure_dir(out_path.parent)
-                download.save_as(str(out_path))
-                print(f"[SAVED] {out_path}")
-                done.add(file_url)
-                save_state(done)
+                if file_key in queued:
+                    continue
+                job = queued[file_key] = (file_url, effective_rel, text)
+                submit(job)
+
+            # The page is free again until the next folder
+            drain_fallbacks(page, fallbacks, done, session["user_agent"])
+    finally:
+        # Wait for queued and in-flight downloads to drain
+        pool.shutdown(wait=True)
+        try:
+            drain_fallbacks(page, fallbacks, done, session["user_agent"])
+        finally:
+            done.close()
 
     page.close()
 
+    # Crawl finished; the next run starts from the top
+    CHECKPOINT_FILE.unlink(missing_ok=True)
+
 def main():
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=True)
         # Constrain downloads to our root
         context = browser.new_context(accept_downloads=True)
+        # Folder/file anchors don't need images or fonts; CSS stays, innerText depends on it
+        if BLOCK_RESOURCE_TYPES or BLOCK_URL_RE:
+            context.route("**/*", block_resources)
         # Playwright saves downloads to a temp dir; we call save_as() to move into DOWNLOAD_ROOT
         try:
             crawl_documents(context)